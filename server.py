@@ -12,15 +12,28 @@ License: MIT
 
 from __future__ import annotations
 
+import asyncio
+import atexit
+import hashlib
 import json
 import os
+import queue
 import shutil
+import signal
 import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
+from types import MappingProxyType
 from typing import Optional
 
-from mcp.server.fastmcp import FastMCP
+import httpx
+from mcp.server.fastmcp import Context, FastMCP
 
 # =============================================================================
 # Configuration
@@ -45,33 +58,138 @@ COST_COMPARISON = {
     "savings": "87%"
 }
 
+# Default per-tool timeouts in seconds; every agent tool accepts an override.
+# Kept tight so a hung call doesn't hold a worker for long.
+_DEFAULT_TIMEOUTS = MappingProxyType({
+    "glm_ask": 60,
+    "glm_summarize": 90,
+    "glm_explain": 90,
+    "glm_review_inline": 120,
+    "glm_analyze": 180,
+    "glm_review": 180,
+    "glm_document": 180,
+    "glm_implement": 300,
+    "glm_refactor": 300,
+    "glm_write_tests": 300,
+    "glm_generate_readme": 300,
+    "glm_batch": 180,
+})
+
+# Upper bound on tasks accepted by a single glm_batch call
+MAX_BATCH_TASKS = 20
+
+# glm_batch tasks allowed to run at the same time
+BATCH_CONCURRENCY = 4
+
+# Anthropic Messages API settings for calls that bypass the CLI
+ANTHROPIC_VERSION = "2023-06-01"
+DIRECT_MAX_TOKENS = 8192
+
+# Trailing stderr lines a pooled session keeps for error reporting
+SESSION_STDERR_LINES = 200
+
+# Idle seconds before a pooled claude session is shut down; override with
+# GLM_SESSION_TIMEOUT
+DEFAULT_SESSION_TIMEOUT = 120.0
+
 
 # =============================================================================
 # Environment Setup
 # =============================================================================
 
+def _parse_env_file(env_file: Path) -> dict[str, str]:
+    """Parse KEY=VALUE lines from a .env file."""
+    parsed = {}
+    with open(env_file) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#") and "=" in line:
+                key, value = line.split("=", 1)
+                value = value.strip().strip('"').strip("'")
+                if key and value:
+                    parsed[key] = value
+    return parsed
+
+
 def load_env() -> None:
-    """Load environment variables from .env file."""
-    env_file = Path(__file__).parent / ".env"
-    if env_file.exists():
-        with open(env_file) as f:
-            for line in f:
-                line = line.strip()
-                if line and not line.startswith("#") and "=" in line:
-                    key, value = line.split("=", 1)
-                    value = value.strip().strip('"').strip("'")
-                    if key and value:
-                        os.environ.setdefault(key, value)
+    """
+    Load environment variables from .env file.
 
+    The parsed result is snapshotted to .env.cache.json alongside the .env
+    file and reused while the .env modification time is unchanged and the
+    snapshot is well-formed; otherwise .env is parsed again and the snapshot
+    rewritten.
+    """
+    env_file = Path(__file__).parent / ".env"
+    if not env_file.exists():
+        return
 
-load_env()
+    mtime = env_file.stat().st_mtime_ns
+    cache_file = env_file.with_name(".env.cache.json")
+    parsed = None
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+        cached_vars = cached.get("mtime") == mtime and cached.get("vars")
+        if isinstance(cached_vars, dict) and all(
+            isinstance(key, str) and isinstance(value, str)
+            for key, value in cached_vars.items()
+        ):
+            parsed = cached_vars
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    if parsed is None:
+        parsed = _parse_env_file(env_file)
+        try:
+            fd = os.open(cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as f:
+                json.dump({"mtime": mtime, "vars": parsed}, f)
+        except OSError:
+            pass
+
+    for key, value in parsed.items():
+        os.environ.setdefault(key, value)
+
+
+# .env is read on first use rather than at import, so tool discovery and
+# informational tools don't touch the disk.
+_env_loaded = False
+_env_lock = threading.Lock()
 
 
 # =============================================================================
 # MCP Server Initialization
 # =============================================================================
 
-mcp = FastMCP(
+class CachedToolsFastMCP(FastMCP):
+    """
+    FastMCP that builds the tools/list response once.
+
+    Clients re-list tools on every session, but the tool set only changes
+    when a tool is added or removed, so the converted schemas are memoized
+    until then.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        self._tools_cache = None
+        super().__init__(*args, **kwargs)
+
+    async def list_tools(self):
+        if self._tools_cache is None:
+            self._tools_cache = await super().list_tools()
+        return self._tools_cache
+
+    def add_tool(self, *args, **kwargs) -> None:
+        self._tools_cache = None
+        super().add_tool(*args, **kwargs)
+
+    def remove_tool(self, *args, **kwargs) -> None:
+        self._tools_cache = None
+        super().remove_tool(*args, **kwargs)
+
+
+mcp = CachedToolsFastMCP(
     name=SERVER_NAME,
     instructions=f"""
 You are GLM-4.7, a cost-efficient AI model accessed through the MCP server.
@@ -91,16 +209,48 @@ When users ask for quick tasks, use haiku. For complex tasks, use sonnet/opus.
 # Utility Functions
 # =============================================================================
 
+def _ensure_env_loaded() -> None:
+    """Load .env into the environment once, on first use."""
+    global _env_loaded
+    if not _env_loaded:
+        with _env_lock:
+            if not _env_loaded:
+                load_env()
+                _env_loaded = True
+
+
 def get_api_key() -> str:
-    """Get Z.ai API key from environment."""
+    """Get Z.ai API key from environment, loading .env on first call."""
+    _ensure_env_loaded()
     return os.environ.get("ZAI_API_KEY", "")
 
 
+def get_session_timeout() -> float:
+    """Idle timeout for pooled sessions from GLM_SESSION_TIMEOUT (.env aware)."""
+    _ensure_env_loaded()
+    try:
+        timeout = float(os.environ.get("GLM_SESSION_TIMEOUT", DEFAULT_SESSION_TIMEOUT))
+    except ValueError:
+        return DEFAULT_SESSION_TIMEOUT
+    return timeout if timeout > 0 else DEFAULT_SESSION_TIMEOUT
+
+
+_ENV_CACHE: Optional[tuple[str, dict]] = None
+
+
 def get_glm_env() -> dict:
-    """Get environment variables for GLM-backed Claude Code."""
+    """
+    Get environment variables for GLM-backed Claude Code.
+
+    The result is cached and only rebuilt when ZAI_API_KEY changes. Callers
+    must treat the returned dict as read-only.
+    """
+    global _ENV_CACHE
     api_key = get_api_key()
     if not api_key:
         raise ValueError("ZAI_API_KEY not configured")
+    if _ENV_CACHE is not None and _ENV_CACHE[0] == api_key:
+        return _ENV_CACHE[1]
 
     env = os.environ.copy()
     env["ANTHROPIC_AUTH_TOKEN"] = api_key
@@ -109,46 +259,653 @@ def get_glm_env() -> dict:
     env["ANTHROPIC_DEFAULT_HAIKU_MODEL"] = MODEL_MAP["haiku"]
     env["ANTHROPIC_DEFAULT_SONNET_MODEL"] = MODEL_MAP["sonnet"]
     env["ANTHROPIC_DEFAULT_OPUS_MODEL"] = MODEL_MAP["opus"]
+    _ENV_CACHE = (api_key, env)
     return env
 
 
+@lru_cache(maxsize=1)
+def _claude_path(path_env: str) -> Optional[str]:
+    """
+    Locate the claude CLI.
+
+    Cached on the PATH value, so the directory scan only reruns if PATH
+    changes. Use claude_installed(), which never keeps a miss cached.
+    """
+    return shutil.which("claude", path=path_env)
+
+
+def claude_installed() -> bool:
+    """Whether the claude CLI is on the current PATH."""
+    if _claude_path(os.environ.get("PATH", os.defpath)) is not None:
+        return True
+    # Don't remember the miss, so installing the CLI is noticed without a restart
+    _claude_path.cache_clear()
+    return False
+
+
+_prereq_ok: Optional[tuple[bool, str]] = None
+
+
 def check_prerequisites() -> tuple[bool, str]:
-    """Check if all prerequisites are met."""
+    """
+    Check if all prerequisites are met.
+
+    A passing result is cached for the life of the server; failures are
+    re-checked on every call so a fixed setup is picked up without a restart.
+    """
+    global _prereq_ok
+    if _prereq_ok is not None:
+        return _prereq_ok
     if not get_api_key():
         return False, "ZAI_API_KEY not set"
-    if not shutil.which("claude"):
+    if not claude_installed():
         return False, "'claude' CLI not found in PATH"
-    return True, "OK"
+    _prereq_ok = (True, "OK")
+    return _prereq_ok
 
 
-def run_glm_agent(
+def _reset_prereq_cache() -> None:
+    """Forget a cached passing check_prerequisites() result."""
+    global _prereq_ok
+    _prereq_ok = None
+
+
+# Agent subprocess environment, prepared once by main() before serving
+_GLM_ENV: Optional[dict] = None
+
+
+# Start agent processes in their own process group so a timeout can take down
+# the Node children the CLI spawns, not just the CLI itself.
+if os.name == "nt":
+    _NEW_PROCESS_GROUP = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+else:
+    _NEW_PROCESS_GROUP = {"start_new_session": True}
+
+
+def _signal_process_group(pid: int, force: bool = False) -> None:
+    """Signal a process group created via _NEW_PROCESS_GROUP."""
+    if os.name == "nt":
+        subprocess.run(
+            ["taskkill", "/F", "/T", "/PID", str(pid)],
+            capture_output=True,
+        )
+        return
+    try:
+        os.killpg(pid, signal.SIGKILL if force else signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+def kill_process_tree(proc: subprocess.Popen) -> None:
+    """Terminate a process started with _NEW_PROCESS_GROUP and its children."""
+    _signal_process_group(proc.pid)
+    try:
+        proc.wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        _signal_process_group(proc.pid, force=True)
+        proc.wait()
+
+
+async def _kill_process_tree_async(proc: asyncio.subprocess.Process) -> None:
+    """Async counterpart of kill_process_tree for asyncio subprocesses."""
+    _signal_process_group(proc.pid)
+    try:
+        await asyncio.wait_for(proc.wait(), 5)
+    except asyncio.TimeoutError:
+        _signal_process_group(proc.pid, force=True)
+        await proc.wait()
+
+
+def _append_stderr(output: str, stderr: str) -> str:
+    """Append agent stderr to its output, skipping known-harmless noise."""
+    if stderr and "experimentalGitDiff" not in stderr:
+        output += f"\n\n[stderr]: {stderr}"
+    return output
+
+
+# =============================================================================
+# Session Pool
+# =============================================================================
+
+class ClaudeSession:
+    """
+    A long-lived ``claude`` process that answers prompts over stdin.
+
+    The CLI is started in stream-json mode, so each prompt is written as one
+    JSON user message and the reply is complete once a ``result`` event is
+    read back. This avoids paying Node/CLI startup on every tool call.
+
+    All prompts sent to a session become one conversation, so sessions are
+    only used when a caller opts in with share_session.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        cwd: Optional[str],
+        allowed_tools: Optional[str],
+        env: dict,
+        skip_permissions: bool = True,
+    ) -> None:
+        cmd = [
+            "claude", "--print",
+            "--input-format", "stream-json",
+            "--output-format", "stream-json",
+            "--verbose",
+        ]
+        if skip_permissions:
+            cmd.append("--dangerously-skip-permissions")
+        cmd.extend(["--model", model])
+        if allowed_tools:
+            cmd.extend(["--allowedTools", allowed_tools])
+
+        self.proc = subprocess.Popen(
+            cmd,
+            cwd=cwd,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+            **_NEW_PROCESS_GROUP,
+        )
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+        self._lines: queue.Queue[Optional[str]] = queue.Queue()
+        self._stderr: deque[str] = deque(maxlen=SESSION_STDERR_LINES)
+        threading.Thread(target=self._pump_stdout, daemon=True).start()
+        threading.Thread(target=self._pump_stderr, daemon=True).start()
+
+    def _pump_stdout(self) -> None:
+        """Forward stdout lines to the queue; ``None`` marks EOF."""
+        for line in self.proc.stdout:
+            self._lines.put(line)
+        self._lines.put(None)
+
+    def _pump_stderr(self) -> None:
+        """Keep the most recent stderr lines for error reporting."""
+        for line in self.proc.stderr:
+            self._stderr.append(line)
+
+    def is_alive(self) -> bool:
+        """Whether the underlying process is still running."""
+        return self.proc.poll() is None
+
+    def send(self, prompt: str, timeout: float) -> Optional[str]:
+        """
+        Send a prompt and wait for the agent's final result.
+
+        Time spent waiting for another caller's prompt to finish counts
+        against timeout.
+
+        Returns:
+            The result text (an error message if the process exited before
+            answering), or None if the prompt could not be delivered, in
+            which case it is safe to retry elsewhere
+
+        Raises:
+            subprocess.TimeoutExpired: If no result arrives within timeout
+        """
+        message = {"type": "user", "message": {"role": "user", "content": prompt}}
+        deadline = time.monotonic() + timeout
+        if not self._lock.acquire(timeout=timeout):
+            raise subprocess.TimeoutExpired(self.proc.args, timeout)
+        try:
+            # An earlier caller may have closed the session after timing out
+            if not self.is_alive() or self.proc.stdin.closed:
+                return None
+            self.last_used = time.monotonic()
+            self._stderr.clear()
+            try:
+                self.proc.stdin.write(json.dumps(message) + "\n")
+                self.proc.stdin.flush()
+            except (OSError, ValueError):
+                return None
+
+            while True:
+                try:
+                    line = self._lines.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    self.close()
+                    raise subprocess.TimeoutExpired(self.proc.args, timeout)
+                if line is None:
+                    # The prompt was delivered and may have acted, so don't
+                    # let the caller replay it
+                    self.proc.wait()
+                    return _append_stderr(
+                        "Error: claude session exited before replying",
+                        "".join(self._stderr).strip(),
+                    )
+
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if event.get("type") != "result":
+                    continue
+
+                self.last_used = time.monotonic()
+                result = event.get("result") or ""
+                if event.get("is_error") and not result:
+                    result = f"Error: {event.get('subtype', 'agent failed')}"
+                return _append_stderr(result.strip(), "".join(self._stderr).strip())
+        finally:
+            self._lock.release()
+
+    def close(self) -> None:
+        """Terminate the process."""
+        if not self.is_alive():
+            return
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        kill_process_tree(self.proc)
+
+
+def _compute_config_hash(
+    model: str,
+    cwd: Optional[str],
+    allowed_tools: Optional[str],
+    skip_permissions: bool = True,
+) -> str:
+    """Hash a session configuration; tool order does not matter."""
+    tools = ",".join(sorted(t.strip() for t in (allowed_tools or "").split(",") if t.strip()))
+    key = "\0".join([model, cwd or "", tools, str(skip_permissions)])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class SessionPool:
+    """
+    Live ``claude`` sessions shared by every call with the same configuration.
+
+    Callers acquire a session, send their prompt and release it. A background
+    thread closes sessions that have no active callers and have been idle for
+    longer than idle_timeout.
+    """
+
+    def __init__(self, idle_timeout: Optional[float] = None) -> None:
+        # None means read GLM_SESSION_TIMEOUT when the pool is first used
+        self.idle_timeout = idle_timeout
+        self._sessions: dict[str, ClaudeSession] = {}
+        self._refs: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+
+    def acquire(
+        self,
+        model: str,
+        cwd: Optional[str],
+        allowed_tools: Optional[str],
+        env: dict,
+        skip_permissions: bool = True,
+    ) -> tuple[str, ClaudeSession]:
+        """
+        Return the config hash and a live session, starting one if needed.
+
+        Every acquire must be paired with a release of the returned hash.
+        """
+        key = _compute_config_hash(model, cwd, allowed_tools, skip_permissions)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None or not session.is_alive():
+                session = ClaudeSession(model, cwd, allowed_tools, env, skip_permissions)
+                self._sessions[key] = session
+            self._refs[key] = self._refs.get(key, 0) + 1
+            if self.idle_timeout is None:
+                self.idle_timeout = get_session_timeout()
+            if self._reaper is None:
+                self._reaper = threading.Thread(
+                    target=self._reap_idle, name="glm-session-reaper", daemon=True,
+                )
+                self._reaper.start()
+            return key, session
+
+    def release(self, key: str) -> None:
+        """Drop a reference taken by acquire."""
+        with self._lock:
+            refs = self._refs.get(key, 0) - 1
+            if refs > 0:
+                self._refs[key] = refs
+            else:
+                self._refs.pop(key, None)
+
+    def _reap_idle(self) -> None:
+        """Run _evict_idle periodically until the pool is closed."""
+        interval = max(min(self.idle_timeout / 2, 30.0), 1.0)
+        while not self._stopped.wait(interval):
+            self._evict_idle()
+
+    def _evict_idle(self) -> None:
+        """Close unreferenced sessions that are dead or idle past the timeout."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, session in list(self._sessions.items()):
+                if self._refs.get(key):
+                    continue
+                if not session.is_alive() or now - session.last_used > self.idle_timeout:
+                    expired.append(self._sessions.pop(key))
+        for session in expired:
+            session.close()
+
+    def close_all(self) -> None:
+        """Stop the reaper and terminate every pooled session."""
+        self._stopped.set()
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._refs.clear()
+        for session in sessions:
+            session.close()
+
+
+_SESSIONS = SessionPool()
+atexit.register(_SESSIONS.close_all)
+
+
+# =============================================================================
+# Agent Execution
+# =============================================================================
+
+# One connection pool for all outbound HTTP, so TCP/TLS setup is paid once
+# and kept-alive connections are reused across tool calls.
+_HTTP = httpx.Client(
+    base_url=ZAI_BASE_URL,
+    headers={"anthropic-version": ANTHROPIC_VERSION},
+    limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+    timeout=300.0,
+)
+atexit.register(_HTTP.close)
+
+
+def _direct_message(prompt: str, model: str, timeout: int) -> str:
+    """
+    Answer a prompt via Z.ai's Anthropic-compatible Messages API.
+
+    Used for tool-less calls, where spawning the claude CLI would only add
+    startup overhead in front of a single completion.
+    """
+    api_key = get_api_key()
+    if not api_key:
+        return "Error: ZAI_API_KEY not set"
+
+    try:
+        response = _HTTP.post(
+            "/v1/messages",
+            headers={"x-api-key": api_key},
+            json={
+                "model": MODEL_MAP.get(model, model),
+                "max_tokens": DIRECT_MAX_TOKENS,
+                "messages": [{"role": "user", "content": prompt}],
+            },
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        data = response.json()
+    except httpx.TimeoutException:
+        return f"Error: Agent timed out after {timeout}s"
+    except httpx.HTTPStatusError as e:
+        return f"Error: API returned {e.response.status_code}: {e.response.text}"
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+    content = data.get("content") if isinstance(data, dict) else None
+    if not isinstance(content, list):
+        return f"Error: Unexpected API response: {response.text[:200]}"
+
+    output = "".join(
+        block["text"] for block in content
+        if isinstance(block, dict)
+        and block.get("type") == "text"
+        and isinstance(block.get("text"), str)
+    ).strip()
+    return output if output else "Agent completed with no output"
+
+
+# One-shot agent output is read in chunks of this size; only the last
+# STDERR_TAIL_CHUNKS chunks of stderr are kept.
+STREAM_CHUNK_SIZE = 64 * 1024
+STDERR_TAIL_CHUNKS = 16
+
+# Seconds to keep reading pipes after the CLI exits before the children it
+# left behind, which may still hold them open, are killed
+PIPE_DRAIN_GRACE = 2.0
+
+
+def _current_context() -> Optional[Context]:
+    """The FastMCP request context, or None outside a tool call."""
+    ctx = mcp.get_context()
+    try:
+        ctx.request_context
+    except ValueError:
+        return None
+    return ctx
+
+
+async def _pump_stream(
+    stream: asyncio.StreamReader,
+    sink: list[bytes] | deque[bytes],
+    ctx: Optional[Context] = None,
+) -> None:
+    """
+    Read a subprocess stream to EOF as output arrives.
+
+    When ctx is given, the running count of output lines is sent to the MCP
+    client as a progress notification.
+    """
+    lines = 0
+    while chunk := await stream.read(STREAM_CHUNK_SIZE):
+        sink.append(chunk)
+        if ctx is not None and b"\n" in chunk:
+            lines += chunk.count(b"\n")
+            await ctx.report_progress(lines)
+
+
+async def _wait_for_exit(proc: asyncio.subprocess.Process) -> None:
+    """
+    Wait for the process itself to exit.
+
+    Process.wait() can also wait for the pipes to close, which children the
+    process left behind may hold open indefinitely.
+    """
+    while proc.returncode is None:
+        await asyncio.sleep(0.1)
+
+
+async def _run_streamed(
+    cmd: list[str],
+    cwd: Optional[str],
+    env: dict,
+    timeout: int,
+) -> tuple[bytes, bytes]:
+    """
+    Run a one-shot agent, reading its output through pipes as it arrives.
+
+    The process tree is killed if the call times out, is cancelled or fails
+    while reading. Once the CLI exits, its pipes are read for up to
+    PIPE_DRAIN_GRACE seconds and then any children it left behind are
+    killed, so they can't hold the call open.
+
+    Returns:
+        stdout and the tail of stderr
+
+    Raises:
+        asyncio.TimeoutError: If the agent does not finish within timeout
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=cwd,
+        env=env,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        **_NEW_PROCESS_GROUP,
+    )
+    stdout_chunks: list[bytes] = []
+    stderr_tail: deque[bytes] = deque(maxlen=STDERR_TAIL_CHUNKS)
+    exited = asyncio.ensure_future(_wait_for_exit(proc))
+    tasks = [
+        asyncio.ensure_future(_pump_stream(proc.stdout, stdout_chunks, _current_context())),
+        asyncio.ensure_future(_pump_stream(proc.stderr, stderr_tail)),
+        exited,
+    ]
+    try:
+        deadline = time.monotonic() + timeout
+        pending = set(tasks)
+        while exited in pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            done, pending = await asyncio.wait(
+                pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                task.result()
+        if pending:
+            done, pending = await asyncio.wait(pending, timeout=PIPE_DRAIN_GRACE)
+            for task in done:
+                task.result()
+        if pending:
+            # Children the CLI left behind still hold its pipes open
+            _signal_process_group(proc.pid)
+            await asyncio.wait(pending, timeout=PIPE_DRAIN_GRACE)
+    finally:
+        if proc.returncode is None:
+            await _kill_process_tree_async(proc)
+        else:
+            _signal_process_group(proc.pid)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return b"".join(stdout_chunks), b"".join(stderr_tail)
+
+
+async def _run_spooled(
+    cmd: list[str],
+    cwd: Optional[str],
+    env: dict,
+    timeout: int,
+) -> tuple[bytes, bytes]:
+    """
+    Run a one-shot agent with its output written straight to temp files.
+
+    The child writes to the files itself, so nothing in this process copies
+    output while a long agent runs; the files are read back once it exits.
+    The process tree is killed if the call times out or is cancelled, and
+    children left behind by the CLI are killed once it exits.
+
+    Returns:
+        stdout and the tail of stderr
+
+    Raises:
+        asyncio.TimeoutError: If the agent does not finish within timeout
+    """
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=cwd,
+            env=env,
+            stdout=out,
+            stderr=err,
+            **_NEW_PROCESS_GROUP,
+        )
+        try:
+            await asyncio.wait_for(proc.wait(), timeout)
+        finally:
+            if proc.returncode is None:
+                await _kill_process_tree_async(proc)
+            else:
+                _signal_process_group(proc.pid)
+
+        out.seek(0)
+        stdout = out.read()
+        size = err.seek(0, os.SEEK_END)
+        err.seek(max(size - STDERR_TAIL_CHUNKS * STREAM_CHUNK_SIZE, 0))
+        return stdout, err.read()
+
+
+def _send_to_session(
+    prompt: str,
+    cwd: Optional[str],
+    model: str,
+    allowed_tools: Optional[str],
+    env: dict,
+    timeout: int,
+    skip_permissions: bool,
+) -> Optional[str]:
+    """Send a prompt to a pooled session; None if it was never delivered."""
+    try:
+        key, session = _SESSIONS.acquire(model, cwd, allowed_tools, env, skip_permissions)
+    except OSError:
+        return None
+    try:
+        return session.send(prompt, timeout)
+    finally:
+        _SESSIONS.release(key)
+
+
+async def _run_glm_agent_async(
     prompt: str,
     cwd: Optional[str] = None,
     model: str = "sonnet",
     allowed_tools: Optional[str] = None,
     timeout: int = 300,
     skip_permissions: bool = True,
+    share_session: bool = False,
+    spool_output: bool = False,
 ) -> str:
     """
-    Run a GLM-backed Claude Code agent.
+    Run a GLM-backed Claude Code agent without blocking the event loop.
 
     Args:
         prompt: The prompt to send to the agent
         cwd: Working directory for the agent
         model: Model to use (haiku, sonnet, opus)
-        allowed_tools: Comma-separated list of allowed tools
+        allowed_tools: Comma-separated list of allowed tools; "" answers
+            through the Messages API directly, without the CLI
         timeout: Timeout in seconds
         skip_permissions: Skip permission prompts
+        share_session: Send the prompt to a pooled session for this
+            configuration instead of a fresh process. Faster to start, but
+            the session keeps every earlier shared prompt in its context
+        spool_output: Write the process output to temp files instead of
+            streaming it through pipes, for long runs with large output (no
+            progress updates). Ignored for shared sessions
 
     Returns:
         The agent's output
     """
-    ok, msg = check_prerequisites()
-    if not ok:
-        return f"Error: {msg}"
-
-    work_dir = cwd or os.getcwd()
+    if allowed_tools == "":
+        return await asyncio.to_thread(_direct_message, prompt, model, timeout)
+
+    env = _GLM_ENV
+    if env is None:
+        # Not started through main(), so no preflight has run
+        ok, msg = check_prerequisites()
+        if not ok:
+            return f"Error: {msg}"
+        env = get_glm_env()
+
+    # An unset directory is passed as None so the agent inherits ours
+    cwd = cwd or None
+
+    output = None
+    if share_session:
+        try:
+            output = await asyncio.to_thread(
+                _send_to_session,
+                prompt, cwd, model, allowed_tools, env, timeout, skip_permissions,
+            )
+        except subprocess.TimeoutExpired:
+            return f"Error: Agent timed out after {timeout}s"
+
+    if output is not None:
+        output = output.strip()
+        return output if output else "Agent completed with no output"
 
+    # Fresh process per prompt, so no conversation carries over between calls
     cmd = ["claude", "--print"]
     if skip_permissions:
         cmd.append("--dangerously-skip-permissions")
@@ -160,39 +917,71 @@ def run_glm_agent(
     cmd.extend(["-p", prompt])
 
     try:
-        result = subprocess.run(
-            cmd,
-            cwd=work_dir,
-            env=get_glm_env(),
-            capture_output=True,
-            text=True,
-            timeout=timeout,
-        )
-
-        output = result.stdout.strip()
-        if result.stderr:
-            stderr = result.stderr.strip()
-            if stderr and "experimentalGitDiff" not in stderr:
-                output += f"\n\n[stderr]: {stderr}"
-
-        return output if output else "Agent completed with no output"
-
-    except subprocess.TimeoutExpired:
-        return f"Error: Agent timed out after {timeout // 60} minutes"
+        if spool_output:
+            stdout, stderr = await _run_spooled(cmd, cwd, env, timeout)
+        else:
+            stdout, stderr = await _run_streamed(cmd, cwd, env, timeout)
+    except asyncio.TimeoutError:
+        return f"Error: Agent timed out after {timeout}s"
     except FileNotFoundError:
         return "Error: 'claude' command not found. Install Claude Code first."
     except Exception as e:
         return f"Error: {str(e)}"
 
+    output = _append_stderr(
+        stdout.decode(errors="replace").strip(),
+        stderr.decode(errors="replace").strip(),
+    )
+    return output if output else "Agent completed with no output"
+
+
+def run_glm_agent(
+    prompt: str,
+    cwd: Optional[str] = None,
+    model: str = "sonnet",
+    allowed_tools: Optional[str] = None,
+    timeout: int = 300,
+    skip_permissions: bool = True,
+    share_session: bool = False,
+) -> str:
+    """
+    Run a GLM-backed Claude Code agent.
+
+    Blocking wrapper around _run_glm_agent_async for callers outside an
+    event loop. MCP tools await the async version directly.
+
+    Args:
+        prompt: The prompt to send to the agent
+        cwd: Working directory for the agent
+        model: Model to use (haiku, sonnet, opus)
+        allowed_tools: Comma-separated list of allowed tools
+        timeout: Timeout in seconds
+        skip_permissions: Skip permission prompts
+        share_session: Use a pooled session instead of a fresh process
+
+    Returns:
+        The agent's output
+    """
+    return asyncio.run(_run_glm_agent_async(
+        prompt=prompt,
+        cwd=cwd,
+        model=model,
+        allowed_tools=allowed_tools,
+        timeout=timeout,
+        skip_permissions=skip_permissions,
+        share_session=share_session,
+    ))
+
 
 # =============================================================================
 # MCP Tools - Quick Tasks
 # =============================================================================
 
 @mcp.tool()
-def glm_ask(
+async def glm_ask(
     question: str,
     model: str = "haiku",
+    timeout: Optional[int] = None,
 ) -> str:
     """
     Quick question to GLM - no tools, fast response.
@@ -205,23 +994,33 @@ def glm_ask(
     Args:
         question: Your question or prompt
         model: "haiku" (fastest) or "sonnet" (better quality)
+        timeout: Seconds before the agent is stopped (default: 60)
 
     Returns:
         GLM's response
     """
-    return run_glm_agent(
+    return await _run_glm_agent_async(
         prompt=question,
         model=model,
         allowed_tools="",
-        timeout=120,
+        timeout=timeout or _DEFAULT_TIMEOUTS["glm_ask"],
     )
 
 
+_SUMMARIZE_STYLES = MappingProxyType({
+    "concise": "Summarize this concisely in 2-3 sentences:",
+    "detailed": "Provide a detailed summary:",
+    "bullet-points": "Summarize as bullet points:",
+    "executive": "Executive summary - key insights only:",
+})
+
+
 @mcp.tool()
-def glm_summarize(
+async def glm_summarize(
     text: str,
     style: str = "concise",
     model: str = "haiku",
+    timeout: Optional[int] = None,
 ) -> str:
     """
     Summarize text using GLM.
@@ -232,26 +1031,26 @@ def glm_summarize(
         text: The text to summarize
         style: "concise", "detailed", "bullet-points", "executive"
         model: "haiku" or "sonnet"
+        timeout: Seconds before the agent is stopped (default: 90)
 
     Returns:
         Summarized text
     """
-    style_prompts = {
-        "concise": "Summarize this concisely in 2-3 sentences:",
-        "detailed": "Provide a detailed summary:",
-        "bullet-points": "Summarize as bullet points:",
-        "executive": "Executive summary - key insights only:",
-    }
-
-    prompt = f"{style_prompts.get(style, style_prompts['concise'])}\n\n{text}"
-    return run_glm_agent(prompt=prompt, model=model, allowed_tools="", timeout=120)
+    prompt = f"{_SUMMARIZE_STYLES.get(style, _SUMMARIZE_STYLES['concise'])}\n\n{text}"
+    return await _run_glm_agent_async(
+        prompt=prompt,
+        model=model,
+        allowed_tools="",
+        timeout=timeout or _DEFAULT_TIMEOUTS["glm_summarize"],
+    )
 
 
 @mcp.tool()
-def glm_explain(
+async def glm_explain(
     code_or_concept: str,
     context: str = "",
     model: str = "haiku",
+    timeout: Optional[int] = None,
 ) -> str:
     """
     Explain code or a concept using GLM.
@@ -262,12 +1061,18 @@ def glm_explain(
         code_or_concept: Code snippet or concept to explain
         context: Additional context (e.g., language, framework)
         model: "haiku" or "sonnet"
+        timeout: Seconds before the agent is stopped (default: 90)
 
     Returns:
         Explanation
     """
     prompt = f"Explain this{': ' + context if context else ''}:\n\n{code_or_concept}"
-    return run_glm_agent(prompt=prompt, model=model, allowed_tools="", timeout=120)
+    return await _run_glm_agent_async(
+        prompt=prompt,
+        model=model,
+        allowed_tools="",
+        timeout=timeout or _DEFAULT_TIMEOUTS["glm_explain"],
+    )
 
 
 # =============================================================================
@@ -275,10 +1080,12 @@ def glm_explain(
 # =============================================================================
 
 @mcp.tool()
-def glm_analyze(
+async def glm_analyze(
     task: str,
     working_directory: str = "",
     model: str = "sonnet",
+    timeout: Optional[int] = None,
+    share_session: bool = False,
 ) -> str:
     """
     Analyze codebase using GLM with read access.
@@ -292,25 +1099,42 @@ def glm_analyze(
         task: Analysis task to perform
         working_directory: Project directory (defaults to current)
         model: "haiku" or "sonnet"
+        timeout: Seconds before the agent is stopped (default: 180)
+        share_session: Reuse a warm claude process for this configuration.
+            Starts faster, but that process keeps earlier shared prompts in
+            its context
 
     Returns:
         Analysis results
     """
-    return run_glm_agent(
+    return await _run_glm_agent_async(
         prompt=task,
         cwd=working_directory or None,
         model=model,
         allowed_tools="Read,Glob,Grep,LS,Bash",
-        timeout=300,
+        timeout=timeout or _DEFAULT_TIMEOUTS["glm_analyze"],
+        share_session=share_session,
     )
 
 
+_REVIEW_FOCI = MappingProxyType({
+    "general": "Review this code for clarity, correctness, and best practices.",
+    "security": "Security audit: find vulnerabilities, injection risks, auth issues.",
+    "performance": "Performance review: find bottlenecks, inefficiencies.",
+    "style": "Style review: naming, formatting, documentation.",
+    "bugs": "Bug hunt: find logic errors, edge cases, potential crashes.",
+    "refactor": "Refactoring suggestions: improve code structure.",
+})
+
+
 @mcp.tool()
-def glm_review(
+async def glm_review(
     code_or_file: str,
     review_focus: str = "general",
     working_directory: str = "",
     model: str = "sonnet",
+    timeout: Optional[int] = None,
+    share_session: bool = False,
 ) -> str:
     """
     Code review by GLM agent.
@@ -322,46 +1146,45 @@ def glm_review(
         review_focus: "general", "security", "performance", "style", "bugs"
         working_directory: Directory context for file paths
         model: "haiku" or "sonnet"
+        timeout: Seconds before the agent is stopped (default: 180 for
+            a file, 120 for inline code)
+        share_session: Reuse a warm claude process for this configuration.
+            Starts faster, but that process keeps earlier shared prompts in
+            its context
 
     Returns:
         Code review with findings and suggestions
     """
-    focus_prompts = {
-        "general": "Review this code for clarity, correctness, and best practices.",
-        "security": "Security audit: find vulnerabilities, injection risks, auth issues.",
-        "performance": "Performance review: find bottlenecks, inefficiencies.",
-        "style": "Style review: naming, formatting, documentation.",
-        "bugs": "Bug hunt: find logic errors, edge cases, potential crashes.",
-        "refactor": "Refactoring suggestions: improve code structure.",
-    }
-
-    focus = focus_prompts.get(review_focus, focus_prompts["general"])
+    focus = _REVIEW_FOCI.get(review_focus, _REVIEW_FOCI["general"])
 
     # Check if it's a file path
     if "\n" not in code_or_file and len(code_or_file) < 200:
         prompt = f"{focus}\n\nFile to review: {code_or_file}\n\nRead the file and provide your review."
-        return run_glm_agent(
+        return await _run_glm_agent_async(
             prompt=prompt,
             cwd=working_directory or None,
             model=model,
             allowed_tools="Read,Glob,Grep",
-            timeout=300,
+            timeout=timeout or _DEFAULT_TIMEOUTS["glm_review"],
+            share_session=share_session,
         )
     else:
         prompt = f"{focus}\n\nCode to review:\n```\n{code_or_file}\n```"
-        return run_glm_agent(
+        return await _run_glm_agent_async(
             prompt=prompt,
             model=model,
             allowed_tools="",
-            timeout=180,
+            timeout=timeout or _DEFAULT_TIMEOUTS["glm_review_inline"],
         )
 
 
 @mcp.tool()
-def glm_find_bugs(
+async def glm_find_bugs(
     code_or_file: str,
     working_directory: str = "",
     model: str = "sonnet",
+    timeout: Optional[int] = None,
+    share_session: bool = False,
 ) -> str:
     """
     Find potential bugs in code using GLM.
@@ -372,15 +1195,21 @@ def glm_find_bugs(
         code_or_file: Inline code or file path to analyze
         working_directory: Directory context for file paths
         model: "haiku" or "sonnet"
+        timeout: Seconds before the agent is stopped (default: as glm_review)
+        share_session: Reuse a warm claude process for this configuration.
+            Starts faster, but that process keeps earlier shared prompts in
+            its context
 
     Returns:
         List of potential bugs with explanations
     """
-    return glm_review(
+    return await glm_review(
         code_or_file=code_or_file,
         review_focus="bugs",
         working_directory=working_directory,
         model=model,
+        timeout=timeout,
+        share_session=share_session,
     )
 
 
@@ -389,11 +1218,12 @@ def glm_find_bugs(
 # =============================================================================
 
 @mcp.tool()
-def glm_implement(
+async def glm_implement(
     task: str,
     working_directory: str,
     allowed_tools: str = "Read,Glob,Grep,Write,Edit,Bash",
     model: str = "sonnet",
+    timeout: Optional[int] = None,
 ) -> str:
     """
     GLM agent with write access for implementation tasks.
@@ -408,6 +1238,7 @@ def glm_implement(
         working_directory: Project directory (REQUIRED)
         allowed_tools: Tools to allow (default: full coding set)
         model: "haiku" or "sonnet"
+        timeout: Seconds before the agent is stopped (default: 300)
 
     Returns:
         Agent's output including changes made
@@ -415,21 +1246,25 @@ def glm_implement(
     if not working_directory:
         return "Error: working_directory is required for implementation tasks"
 
-    return run_glm_agent(
+    return await _run_glm_agent_async(
         prompt=task,
         cwd=working_directory,
         model=model,
         allowed_tools=allowed_tools,
-        timeout=600,
+        timeout=timeout or _DEFAULT_TIMEOUTS["glm_implement"],
+        # Always one-shot, so long write runs spool their output to disk
+        share_session=False,
+        spool_output=True,
     )
 
 
 @mcp.tool()
-def glm_refactor(
+async def glm_refactor(
     file_path: str,
     instructions: str,
     working_directory: str,
     model: str = "sonnet",
+    timeout: Optional[int] = None,
 ) -> str:
     """
     Refactor code using GLM.
@@ -441,6 +1276,7 @@ def glm_refactor(
         instructions: Refactoring instructions
         working_directory: Project directory
         model: "haiku" or "sonnet"
+        timeout: Seconds before the agent is stopped (default: 300)
 
     Returns:
         Refactored code and explanation
@@ -453,21 +1289,25 @@ Instructions: {instructions}
 2. Apply the refactoring
 3. Explain the changes made
 """
-    return run_glm_agent(
+    return await _run_glm_agent_async(
         prompt=prompt,
         cwd=working_directory,
         model=model,
         allowed_tools="Read,Write,Edit",
-        timeout=600,
+        timeout=timeout or _DEFAULT_TIMEOUTS["glm_refactor"],
+        # Always one-shot, so long write runs spool their output to disk
+        share_session=False,
+        spool_output=True,
     )
 
 
 @mcp.tool()
-def glm_write_tests(
+async def glm_write_tests(
     file_path: str,
     test_framework: str = "pytest",
     working_directory: str = "",
     model: str = "sonnet",
+    timeout: Optional[int] = None,
 ) -> str:
     """
     Generate unit tests for a file using GLM.
@@ -479,6 +1319,7 @@ def glm_write_tests(
         test_framework: "pytest", "jest", "vitest", "unittest"
         working_directory: Project directory
         model: "haiku" or "sonnet"
+        timeout: Seconds before the agent is stopped (default: 300)
 
     Returns:
         Generated test file
@@ -494,12 +1335,12 @@ Test framework: {test_framework}
    - Error handling
 3. Create the test file
 """
-    return run_glm_agent(
+    return await _run_glm_agent_async(
         prompt=prompt,
         cwd=working_directory or None,
         model=model,
         allowed_tools="Read,Write,Edit,Glob,Grep",
-        timeout=600,
+        timeout=timeout or _DEFAULT_TIMEOUTS["glm_write_tests"],
     )
 
 
@@ -507,12 +1348,21 @@ Test framework: {test_framework}
 # MCP Tools - Documentation
 # =============================================================================
 
+_DOC_STYLES = MappingProxyType({
+    "google": "Google style docstrings",
+    "sphinx": "Sphinx/reStructuredText style",
+    "numpy": "NumPy style docstrings",
+    "javadoc": "Javadoc style comments",
+})
+
+
 @mcp.tool()
-def glm_document(
+async def glm_document(
     file_path: str,
     style: str = "google",
     working_directory: str = "",
     model: str = "haiku",
+    timeout: Optional[int] = None,
 ) -> str:
     """
     Add or update documentation for a file using GLM.
@@ -524,40 +1374,42 @@ def glm_document(
         style: "google", "sphinx", "numpy", "javadoc"
         working_directory: Project directory
         model: "haiku" or "sonnet"
+        timeout: Seconds before the agent is stopped (default: 180)
 
     Returns:
         File with added documentation
     """
-    style_guide = {
-        "google": "Google style docstrings",
-        "sphinx": "Sphinx/reStructuredText style",
-        "numpy": "NumPy style docstrings",
-        "javadoc": "Javadoc style comments",
-    }
-
     prompt = f"""Add documentation to {file_path}.
 
-Documentation style: {style_guide.get(style, "standard")}
+Documentation style: {_DOC_STYLES.get(style, "standard")}
 
 1. Read the file
 2. Add appropriate docstrings to functions/classes
 3. Add inline comments where needed
 4. Update the file in place
 """
-    return run_glm_agent(
+    return await _run_glm_agent_async(
         prompt=prompt,
         cwd=working_directory or None,
         model=model,
         allowed_tools="Read,Edit",
-        timeout=300,
+        timeout=timeout or _DEFAULT_TIMEOUTS["glm_document"],
     )
 
 
+_README_STYLES = MappingProxyType({
+    "standard": "Include: description, installation, usage, license",
+    "comprehensive": "Include: badges, description, features, installation, usage, API docs, contributing, license",
+    "minimal": "Brief description and quick start only",
+})
+
+
 @mcp.tool()
-def glm_generate_readme(
+async def glm_generate_readme(
     working_directory: str,
     style: str = "standard",
     model: str = "sonnet",
+    timeout: Optional[int] = None,
 ) -> str:
     """
     Generate a README.md for a project using GLM.
@@ -568,31 +1420,92 @@ def glm_generate_readme(
         working_directory: Project directory
         style: "standard", "comprehensive", "minimal"
         model: "haiku" or "sonnet"
+        timeout: Seconds before the agent is stopped (default: 300)
 
     Returns:
         Generated README.md content
     """
-    style_instructions = {
-        "standard": "Include: description, installation, usage, license",
-        "comprehensive": "Include: badges, description, features, installation, usage, API docs, contributing, license",
-        "minimal": "Brief description and quick start only",
-    }
-
     prompt = f"""Generate a README.md for this project.
 
-Style: {style_instructions.get(style, style_instructions["standard"])}
+Style: {_README_STYLES.get(style, _README_STYLES["standard"])}
 
 1. Explore the project structure
 2. Read key files (package.json, setup.py, etc.)
 3. Generate an appropriate README.md
 4. Write the README.md file
 """
-    return run_glm_agent(
+    return await _run_glm_agent_async(
         prompt=prompt,
         cwd=working_directory,
         model=model,
         allowed_tools="Read,Glob,Grep,LS,Write",
-        timeout=600,
+        timeout=timeout or _DEFAULT_TIMEOUTS["glm_generate_readme"],
+        # Always one-shot, so long write runs spool their output to disk
+        share_session=False,
+        spool_output=True,
+    )
+
+
+# =============================================================================
+# MCP Tools - Batch
+# =============================================================================
+
+@mcp.tool()
+async def glm_batch(
+    tasks: list[dict],
+    timeout: Optional[int] = None,
+) -> str:
+    """
+    Run several independent GLM prompts concurrently in one call.
+
+    Use for: fanning out unrelated questions or analyses instead of
+    issuing one tool call per prompt. Each task runs in its own fresh
+    conversation; up to BATCH_CONCURRENCY tasks run at once.
+
+    Args:
+        tasks: List of tasks, each a dict with "prompt" and optionally
+            "model" (default "haiku"), "allowed_tools" (default "" - no
+            tools) and "working_directory"
+        timeout: Seconds allowed for the whole batch (default: 180);
+            tasks still running at the deadline are stopped
+
+    Returns:
+        Each task's output, in order
+    """
+    if not tasks:
+        return "Error: no tasks given"
+    if len(tasks) > MAX_BATCH_TASKS:
+        return f"Error: at most {MAX_BATCH_TASKS} tasks per batch"
+
+    limit = timeout or _DEFAULT_TIMEOUTS["glm_batch"]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + limit
+    slots = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def run_task(task: dict) -> str:
+        if not isinstance(task, dict) or not task.get("prompt"):
+            return "Error: task has no prompt"
+        async with slots:
+            return await _run_glm_agent_async(
+                prompt=task["prompt"],
+                cwd=task.get("working_directory") or None,
+                model=task.get("model") or "haiku",
+                allowed_tools=task.get("allowed_tools") or "",
+                timeout=max(int(deadline - loop.time()), 1),
+            )
+
+    futures = [asyncio.ensure_future(run_task(task)) for task in tasks]
+    _, pending = await asyncio.wait(futures, timeout=limit)
+    for future in pending:
+        future.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+
+    results = [
+        f"Error: Batch deadline of {limit}s reached" if future.cancelled() else future.result()
+        for future in futures
+    ]
+    return "\n\n".join(
+        f"─── Task {i} ───\n{result}" for i, result in enumerate(results, 1)
     )
 
 
@@ -600,6 +1513,63 @@ Style: {style_instructions.get(style, style_instructions["standard"])}
 # MCP Tools - Status & Info
 # =============================================================================
 
+_STATUS_TEMPLATE = "\n".join([
+    "╔════════════════════════════════════════════════════════════════════╗",
+    "║                    GLM-4.7 MCP Server Status                        ║",
+    "╚════════════════════════════════════════════════════════════════════╝",
+    "",
+    f"Version: {__version__}",
+    f"Server Name: {SERVER_NAME}",
+    "",
+    "─── Configuration ───",
+    "API Key: {api_status}",
+    "Claude CLI: {claude_status}",
+    f"Base URL: {ZAI_BASE_URL}",
+    "",
+    "─── Model Mappings ───",
+    f"  haiku  → {MODEL_MAP['haiku']} (fast, lightweight)",
+    f"  sonnet → {MODEL_MAP['sonnet']} (balanced)",
+    f"  opus   → {MODEL_MAP['opus']} (highest quality)",
+    "",
+    "─── Cost Savings ───",
+    f"  Claude Opus: ${COST_COMPARISON['claude_opus']}/M tokens",
+    f"  GLM-4.7:     ${COST_COMPARISON['glm_47']}/M tokens",
+    f"  Savings:     {COST_COMPARISON['savings']}",
+    "",
+    "{setup_hints}─── Available Tools ───",
+    "  glm_ask         - Quick questions (no tools)",
+    "  glm_summarize   - Summarize text",
+    "  glm_explain     - Explain code/concepts",
+    "  glm_analyze     - Analyze codebase (read-only)",
+    "  glm_review      - Code review",
+    "  glm_find_bugs   - Find potential bugs",
+    "  glm_implement   - Implementation tasks (write)",
+    "  glm_refactor    - Refactor code",
+    "  glm_write_tests - Generate unit tests",
+    "  glm_document    - Add documentation",
+    "  glm_generate_readme - Generate README.md",
+    "  glm_batch       - Run several prompts concurrently",
+    "  glm_status      - Show this status",
+])
+
+_SETUP_API_KEY_HINT = "\n".join([
+    "─── Setup Needed ───",
+    "1. Get API key from https://z.ai/subscribe",
+    "2. Set ZAI_API_KEY environment variable",
+    "3. Or add to .env file in server directory",
+    "",
+    "",
+])
+
+_SETUP_CLAUDE_HINT = "\n".join([
+    "─── Claude CLI Not Found ───",
+    "Install from: https://claude.ai/download",
+    "Or: npm install -g @anthropic-ai/claude-code",
+    "",
+    "",
+])
+
+
 @mcp.tool()
 def glm_status() -> str:
     """
@@ -609,69 +1579,40 @@ def glm_status() -> str:
         Status information about the GLM server setup
     """
     api_key = get_api_key()
-    claude_installed = shutil.which("claude") is not None
-    api_key_configured = bool(api_key)
-    key_hint = f"{api_key[:4]}...{api_key[-4:]}" if api_key else "N/A"
-
-    status_parts = [
-        "╔════════════════════════════════════════════════════════════════════╗",
-        "║                    GLM-4.7 MCP Server Status                        ║",
-        "╚════════════════════════════════════════════════════════════════════╝",
-        "",
-        f"Version: {__version__}",
-        f"Server Name: {SERVER_NAME}",
-        "",
-        "─── Configuration ───",
-        f"API Key: {'✓ Configured (' + key_hint + ')' if api_key_configured else '✗ NOT SET'}",
-        f"Claude CLI: {'✓ Found' if claude_installed else '✗ NOT FOUND'}",
-        f"Base URL: {ZAI_BASE_URL}",
-        "",
-        "─── Model Mappings ───",
-        f"  haiku  → {MODEL_MAP['haiku']} (fast, lightweight)",
-        f"  sonnet → {MODEL_MAP['sonnet']} (balanced)",
-        f"  opus   → {MODEL_MAP['opus']} (highest quality)",
-        "",
-        "─── Cost Savings ───",
-        f"  Claude Opus: ${COST_COMPARISON['claude_opus']}/M tokens",
-        f"  GLM-4.7:     ${COST_COMPARISON['glm_47']}/M tokens",
-        f"  Savings:     {COST_COMPARISON['savings']}",
-        "",
-    ]
+    claude_found = claude_installed()
+
+    if api_key:
+        api_status = f"✓ Configured ({api_key[:4]}...{api_key[-4:]})"
+    else:
+        api_status = "✗ NOT SET"
 
+    setup_hints = ""
     if not api_key:
-        status_parts.extend([
-            "─── Setup Needed ───",
-            "1. Get API key from https://z.ai/subscribe",
-            "2. Set ZAI_API_KEY environment variable",
-            "3. Or add to .env file in server directory",
-            "",
-        ])
-
-    if not claude_installed:
-        status_parts.extend([
-            "─── Claude CLI Not Found ───",
-            "Install from: https://claude.ai/download",
-            "Or: npm install -g @anthropic-ai/claude-code",
-            "",
-        ])
-
-    status_parts.extend([
-        "─── Available Tools ───",
-        "  glm_ask         - Quick questions (no tools)",
-        "  glm_summarize   - Summarize text",
-        "  glm_explain     - Explain code/concepts",
-        "  glm_analyze     - Analyze codebase (read-only)",
-        "  glm_review      - Code review",
-        "  glm_find_bugs   - Find potential bugs",
-        "  glm_implement   - Implementation tasks (write)",
-        "  glm_refactor    - Refactor code",
-        "  glm_write_tests - Generate unit tests",
-        "  glm_document    - Add documentation",
-        "  glm_generate_readme - Generate README.md",
-        "  glm_status      - Show this status",
-    ])
-
-    return "\n".join(status_parts)
+        setup_hints += _SETUP_API_KEY_HINT
+    if not claude_found:
+        setup_hints += _SETUP_CLAUDE_HINT
+
+    return _STATUS_TEMPLATE.format(
+        api_status=api_status,
+        claude_status="✓ Found" if claude_found else "✗ NOT FOUND",
+        setup_hints=setup_hints,
+    )
+
+
+# Per-token prices in dollars (per-million list prices / 1e6)
+_CLAUDE_IN, _CLAUDE_OUT, _GLM_IN, _GLM_OUT = 15e-6, 75e-6, 2e-6, 8e-6
+
+_COST_TEMPLATE = """
+╔════════════════════════════════════════════════════════════════════╗
+║                      Cost Comparison                                 ║
+╠════════════════════════════════════════════════════════════════════╣
+║  Tokens: {tokens_input:,} input, {tokens_output:,} output                         ║
+╠════════════════════════════════════════════════════════════════════╣
+║  Claude Opus:  ${claude_cost:.4f}                                           ║
+║  GLM-4.7:      ${glm_cost:.4f}                                           ║
+║  Savings:      ${savings:.4f} ({savings_pct:.1f}%)                          ║
+╚════════════════════════════════════════════════════════════════════╝
+"""
 
 
 @mcp.tool()
@@ -689,29 +1630,19 @@ def glm_compare_costs(
     Returns:
         Cost comparison table
     """
-    claude_opus_input = 15.0  # per million
-    claude_opus_output = 75.0
-    glm_47_input = 2.0
-    glm_47_output = 8.0
-
-    claude_cost = (tokens_input / 1_000_000) * claude_opus_input + \
-                  (tokens_output / 1_000_000) * claude_opus_output
-    glm_cost = (tokens_input / 1_000_000) * glm_47_input + \
-               (tokens_output / 1_000_000) * glm_47_output
+    claude_cost = tokens_input * _CLAUDE_IN + tokens_output * _CLAUDE_OUT
+    glm_cost = tokens_input * _GLM_IN + tokens_output * _GLM_OUT
     savings = claude_cost - glm_cost
     savings_pct = (savings / claude_cost * 100) if claude_cost > 0 else 0
 
-    return f"""
-╔════════════════════════════════════════════════════════════════════╗
-║                      Cost Comparison                                 ║
-╠════════════════════════════════════════════════════════════════════╣
-║  Tokens: {tokens_input:,} input, {tokens_output:,} output                         ║
-╠════════════════════════════════════════════════════════════════════╣
-║  Claude Opus:  ${claude_cost:.4f}                                           ║
-║  GLM-4.7:      ${glm_cost:.4f}                                           ║
-║  Savings:      ${savings:.4f} ({savings_pct:.1f}%)                          ║
-╚════════════════════════════════════════════════════════════════════╝
-"""
+    return _COST_TEMPLATE.format(
+        tokens_input=tokens_input,
+        tokens_output=tokens_output,
+        claude_cost=claude_cost,
+        glm_cost=glm_cost,
+        savings=savings,
+        savings_pct=savings_pct,
+    )
 
 
 # =============================================================================
@@ -719,7 +1650,19 @@ def glm_compare_costs(
 # =============================================================================
 
 def main():
-    """Run the MCP server."""
+    """Validate the setup, prepare the agent environment and run the MCP server."""
+    global _GLM_ENV
+    if not get_api_key():
+        sys.exit(
+            "Error: ZAI_API_KEY not set. Get a key from https://z.ai/subscribe "
+            "and set it in the environment or in .env next to server.py."
+        )
+
+    ok, msg = check_prerequisites()
+    if not ok:
+        print(f"Warning: {msg}; only tools without file access will work", file=sys.stderr)
+
+    _GLM_ENV = get_glm_env()
     mcp.run()
 
 
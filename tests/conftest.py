@@ -0,0 +1,80 @@
+"""Shared fixtures: a fake ``claude`` CLI and a clean server state."""
+
+from __future__ import annotations
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+import server
+
+FAKE_CLAUDE = """\
+#!{python}
+import json, os, subprocess, sys, time
+
+def act(prompt):
+    if prompt.startswith("sleep "):
+        time.sleep(float(prompt.split()[1]))
+    elif prompt.startswith("spawn "):
+        child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+        with open(prompt.split()[1], "w") as f:
+            f.write(f"{{os.getpid()}} {{child.pid}}")
+        time.sleep(60)
+    elif prompt.startswith("orphan "):
+        # Leave behind a child that keeps stdout open after the CLI exits
+        child = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+        with open(prompt.split()[1], "w") as f:
+            f.write(str(child.pid))
+    elif prompt == "die":
+        sys.exit(1)
+    elif prompt == "warn":
+        print("cli warning", file=sys.stderr, flush=True)
+        time.sleep(0.2)
+
+args = sys.argv[1:]
+if "--input-format" in args:
+    seen = []
+    for line in sys.stdin:
+        prompt = json.loads(line)["message"]["content"]
+        seen.append(prompt)
+        act(prompt)
+        reply = f"pid={{os.getpid()}} seen={{seen}}"
+        print(json.dumps({{"type": "result", "result": reply}}), flush=True)
+else:
+    prompt = args[args.index("-p") + 1]
+    act(prompt)
+    print(f"pid={{os.getpid()}} seen={{[prompt]}}")
+"""
+
+
+@pytest.fixture(autouse=True)
+def clean_server(monkeypatch):
+    """Isolate module-level caches and give each test its own session pool."""
+    monkeypatch.setattr(server, "_env_loaded", True)
+    monkeypatch.setattr(server, "_ENV_CACHE", None)
+    monkeypatch.setattr(server, "_GLM_ENV", None)
+    monkeypatch.setenv("ZAI_API_KEY", "test-key-1234")
+    server._reset_prereq_cache()
+    server._claude_path.cache_clear()
+    pool = server.SessionPool()
+    monkeypatch.setattr(server, "_SESSIONS", pool)
+    yield
+    pool.close_all()
+    server._reset_prereq_cache()
+    server._claude_path.cache_clear()
+
+
+@pytest.fixture
+def fake_claude(tmp_path: Path, monkeypatch) -> Path:
+    """Put a fake ``claude`` CLI first on PATH and return its directory."""
+    if os.name == "nt":
+        pytest.skip("fake claude CLI is a POSIX script")
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "claude"
+    script.write_text(FAKE_CLAUDE.format(python=sys.executable))
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return bin_dir
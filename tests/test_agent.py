@@ -0,0 +1,116 @@
+"""Tests for run_glm_agent and the one-shot agent path."""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+
+import pytest
+
+import server
+
+
+def test_calls_do_not_share_a_conversation_by_default(fake_claude):
+    first = server.run_glm_agent("secret project A", allowed_tools="Read")
+    second = server.run_glm_agent("what is 2+2", allowed_tools="Read")
+
+    assert "seen=['secret project A']" in first
+    assert "seen=['what is 2+2']" in second
+    assert not server._SESSIONS._sessions
+
+
+def test_shared_session_keeps_one_conversation(fake_claude):
+    server.run_glm_agent("one", allowed_tools="Read", share_session=True)
+    second = server.run_glm_agent("two", allowed_tools="Read", share_session=True)
+
+    assert "seen=['one', 'two']" in second
+
+
+def _is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+@pytest.mark.parametrize("spool_output", [False, True])
+def test_cancelled_call_kills_process_tree(fake_claude, tmp_path, spool_output):
+    pidfile = tmp_path / "pids"
+
+    async def cancel_midway():
+        task = asyncio.ensure_future(server._run_glm_agent_async(
+            f"spawn {pidfile}", allowed_tools="Read", spool_output=spool_output,
+        ))
+        for _ in range(100):
+            if pidfile.exists() and pidfile.read_text():
+                break
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_midway())
+
+    cli_pid, child_pid = map(int, pidfile.read_text().split())
+    # The fake CLI is reaped by asyncio; its orphaned child is reaped by init
+    for _ in range(50):
+        if not _is_running(child_pid):
+            break
+        time.sleep(0.05)
+    assert not _is_running(cli_pid)
+    assert not _is_running(child_pid)
+
+
+@pytest.mark.parametrize("spool_output", [False, True])
+def test_timeout_kills_process_tree(fake_claude, spool_output):
+    start = time.monotonic()
+    output = asyncio.run(server._run_glm_agent_async(
+        "sleep 30", allowed_tools="Read", timeout=1, spool_output=spool_output,
+    ))
+
+    assert output == "Error: Agent timed out after 1s"
+    assert time.monotonic() - start < 5
+
+
+@pytest.mark.parametrize("spool_output", [False, True])
+def test_output_is_returned_when_cli_leaves_a_child_behind(fake_claude, tmp_path, spool_output):
+    pidfile = tmp_path / "pid"
+    start = time.monotonic()
+    output = asyncio.run(server._run_glm_agent_async(
+        f"orphan {pidfile}", allowed_tools="Read", timeout=10, spool_output=spool_output,
+    ))
+
+    assert f"seen=['orphan {pidfile}']" in output
+    assert time.monotonic() - start < 5
+    child_pid = int(pidfile.read_text())
+    for _ in range(50):
+        if not _is_running(child_pid):
+            break
+        time.sleep(0.05)
+    assert not _is_running(child_pid)
+
+
+@pytest.mark.parametrize(
+    "tool, kwargs",
+    [
+        (server.glm_implement, {"task": "add a flag"}),
+        (server.glm_refactor, {"file_path": "app.py", "instructions": "simplify"}),
+        (server.glm_generate_readme, {}),
+    ],
+)
+def test_write_tools_run_one_shot_and_spool_output(fake_claude, monkeypatch, tmp_path, tool, kwargs):
+    spooled = []
+    run_spooled = server._run_spooled
+
+    async def record(*args, **kw):
+        spooled.append(args)
+        return await run_spooled(*args, **kw)
+
+    monkeypatch.setattr(server, "_run_spooled", record)
+    output = asyncio.run(tool(working_directory=str(tmp_path), **kwargs))
+
+    assert "seen=" in output
+    assert len(spooled) == 1
+    assert not server._SESSIONS._sessions
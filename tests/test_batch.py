@@ -0,0 +1,50 @@
+"""Tests for the glm_batch tool."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+import server
+
+
+def test_batch_tasks_do_not_share_a_conversation(fake_claude):
+    output = asyncio.run(server.glm_batch([
+        {"prompt": "task one", "allowed_tools": "Read"},
+        {"prompt": "task two", "allowed_tools": "Read"},
+    ]))
+
+    assert "seen=['task one']" in output
+    assert "seen=['task two']" in output
+    assert not server._SESSIONS._sessions
+
+
+def test_batch_deadline_bounds_the_whole_batch(fake_claude):
+    tasks = [{"prompt": "sleep 30", "allowed_tools": "Read"}] * 6
+
+    start = time.monotonic()
+    output = asyncio.run(server.glm_batch(tasks, timeout=1))
+
+    assert time.monotonic() - start < 5
+    assert output.count("Error:") == 6
+
+
+def test_batch_rejects_tasks_without_prompt(fake_claude):
+    output = asyncio.run(server.glm_batch([{"model": "haiku"}]))
+
+    assert "Error: task has no prompt" in output
+
+
+def test_batch_null_options_fall_back_to_defaults(fake_claude, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        server, "_direct_message",
+        lambda prompt, model, timeout: calls.append((prompt, model)) or "direct",
+    )
+
+    output = asyncio.run(server.glm_batch([
+        {"prompt": "question", "model": None, "allowed_tools": None},
+    ]))
+
+    assert calls == [("question", "haiku")]
+    assert "direct" in output
@@ -0,0 +1,56 @@
+"""Tests for tool-less calls answered through the Messages API."""
+
+from __future__ import annotations
+
+import json
+
+import httpx
+import pytest
+
+import server
+
+
+@pytest.fixture
+def respond(monkeypatch):
+    """Route _HTTP to a handler returning the given JSON body."""
+    def install(body, status=200):
+        def handler(request):
+            return httpx.Response(status, content=json.dumps(body))
+        monkeypatch.setattr(server._HTTP, "_transport", httpx.MockTransport(handler))
+    return install
+
+
+def test_text_blocks_are_joined(respond):
+    respond({"content": [
+        {"type": "text", "text": "Hello, "},
+        {"type": "tool_use", "id": "x"},
+        {"type": "text", "text": "world"},
+    ]})
+
+    assert server._direct_message("hi", "haiku", 10) == "Hello, world"
+
+
+@pytest.mark.parametrize("body", [
+    ["not", "a", "dict"],
+    {"content": None},
+    {"content": "text"},
+    "just a string",
+])
+def test_malformed_response_is_an_error_string(respond, body):
+    respond(body)
+
+    assert server._direct_message("hi", "haiku", 10).startswith(
+        "Error: Unexpected API response"
+    )
+
+
+def test_non_dict_blocks_are_skipped(respond):
+    respond({"content": ["stray", {"type": "text", "text": "ok"}, {"type": "text"}]})
+
+    assert server._direct_message("hi", "haiku", 10) == "ok"
+
+
+def test_http_error_status_is_reported(respond):
+    respond({"error": "bad key"}, status=401)
+
+    assert server._direct_message("hi", "haiku", 10).startswith("Error: API returned 401")
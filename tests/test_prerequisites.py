@@ -0,0 +1,59 @@
+"""Tests for prerequisite checks and the claude CLI lookup."""
+
+from __future__ import annotations
+
+import json
+import os
+
+import pytest
+
+import server
+
+
+def test_missing_key_is_reported(monkeypatch, fake_claude):
+    monkeypatch.delenv("ZAI_API_KEY")
+
+    assert server.check_prerequisites() == (False, "ZAI_API_KEY not set")
+
+
+@pytest.mark.skipif(os.name == "nt", reason="uses a POSIX shell script as the CLI")
+def test_cli_installed_later_is_picked_up(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    monkeypatch.setenv("PATH", str(bin_dir))
+
+    assert server.check_prerequisites() == (False, "'claude' CLI not found in PATH")
+    assert "✗ NOT FOUND" in server.glm_status()
+
+    script = bin_dir / "claude"
+    script.write_text("#!/bin/sh\n")
+    script.chmod(0o755)
+
+    assert server.check_prerequisites() == (True, "OK")
+    assert "✓ Found" in server.glm_status()
+
+
+def test_passing_check_is_cached_until_reset(monkeypatch, fake_claude):
+    assert server.check_prerequisites() == (True, "OK")
+
+    monkeypatch.setenv("PATH", os.defpath)
+    assert server.check_prerequisites() == (True, "OK")
+
+    server._reset_prereq_cache()
+    monkeypatch.setenv("PATH", str(fake_claude.parent / "empty"))
+    assert server.check_prerequisites() == (False, "'claude' CLI not found in PATH")
+
+
+@pytest.mark.parametrize("cached_vars", [["x"], "x", {"ZAI_API_KEY": 1}])
+def test_malformed_env_cache_is_reparsed(monkeypatch, tmp_path, cached_vars):
+    env_file = tmp_path / ".env"
+    env_file.write_text("ZAI_API_KEY=from-env-file\n")
+    cache_file = tmp_path / ".env.cache.json"
+    mtime = env_file.stat().st_mtime_ns
+    cache_file.write_text(json.dumps({"mtime": mtime, "vars": cached_vars}))
+    monkeypatch.delenv("ZAI_API_KEY")
+    monkeypatch.setattr(server, "_env_loaded", False)
+    monkeypatch.setattr(server, "__file__", str(tmp_path / "server.py"))
+
+    assert server.get_api_key() == "from-env-file"
+    assert json.loads(cache_file.read_text())["vars"] == {"ZAI_API_KEY": "from-env-file"}
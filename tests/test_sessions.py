@@ -0,0 +1,141 @@
+"""Tests for ClaudeSession and SessionPool."""
+
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def session(fake_claude):
+    session = server.ClaudeSession("haiku", None, "Read", server.get_glm_env())
+    yield session
+    session.close()
+
+
+def test_lock_wait_counts_against_timeout(session):
+    busy = threading.Thread(target=session.send, args=("sleep 3", 10))
+    busy.start()
+    time.sleep(0.5)
+
+    start = time.monotonic()
+    with pytest.raises(server.subprocess.TimeoutExpired):
+        session.send("queued", 1)
+    assert time.monotonic() - start < 2
+
+    busy.join()
+    assert session.is_alive()
+
+
+def test_caller_queued_behind_a_timeout_is_not_delivered(session):
+    timed_out = []
+
+    def send_and_time_out():
+        try:
+            session.send("sleep 5", 1)
+        except server.subprocess.TimeoutExpired:
+            timed_out.append(True)
+
+    first = threading.Thread(target=send_and_time_out)
+    first.start()
+    time.sleep(0.5)
+
+    assert session.send("queued", 20) is None
+    first.join()
+    assert timed_out
+    assert not session.is_alive()
+
+
+def test_session_timeout_is_read_from_env_file_on_first_use(monkeypatch, tmp_path):
+    env_file = tmp_path / ".env"
+    env_file.write_text("GLM_SESSION_TIMEOUT=5\n")
+    # Record the variable so monkeypatch removes what load_env() sets
+    monkeypatch.setenv("GLM_SESSION_TIMEOUT", "")
+    monkeypatch.delenv("GLM_SESSION_TIMEOUT")
+    monkeypatch.setattr(server, "_env_loaded", False)
+    monkeypatch.setattr(server, "__file__", str(tmp_path / "server.py"))
+
+    assert server.get_session_timeout() == 5.0
+
+
+@pytest.mark.parametrize("value", ["soon", "0", "-3"])
+def test_invalid_session_timeout_falls_back_to_default(monkeypatch, value):
+    monkeypatch.setenv("GLM_SESSION_TIMEOUT", value)
+    assert server.get_session_timeout() == server.DEFAULT_SESSION_TIMEOUT
+
+
+def test_session_dying_mid_reply_is_not_replayed(fake_claude):
+    output = server.run_glm_agent("die", allowed_tools="Read", share_session=True)
+
+    assert output.startswith("Error: claude session exited before replying")
+    assert "seen=" not in output
+
+
+def test_session_reports_stderr(fake_claude):
+    output = server.run_glm_agent("warn", allowed_tools="Read", share_session=True)
+
+    assert "seen=['warn']" in output
+    assert "[stderr]: cli warning" in output
+
+
+@pytest.fixture
+def pool(fake_claude):
+    pool = server.SessionPool(idle_timeout=60)
+    yield pool
+    pool.close_all()
+
+
+def _acquire(pool, allowed_tools="Read,Grep"):
+    return pool.acquire("haiku", None, allowed_tools, server.get_glm_env())
+
+
+def test_acquire_release_pairing(pool):
+    key, first = _acquire(pool)
+    same_key, second = _acquire(pool, "Grep,Read")
+
+    assert same_key == key
+    assert second is first
+    assert pool._refs[key] == 2
+
+    pool.release(key)
+    assert pool._refs[key] == 1
+    pool.release(key)
+    assert key not in pool._refs
+
+
+def test_busy_session_is_not_evicted(pool):
+    key, session = _acquire(pool)
+    session.last_used -= 120
+
+    pool._evict_idle()
+
+    assert pool._sessions[key] is session
+    assert session.is_alive()
+    pool.release(key)
+
+
+def test_idle_session_is_evicted(pool):
+    key, session = _acquire(pool)
+    pool.release(key)
+
+    pool._evict_idle()
+    assert key in pool._sessions
+
+    session.last_used -= 120
+    pool._evict_idle()
+    assert key not in pool._sessions
+    assert not session.is_alive()
+
+
+def test_dead_session_is_evicted(pool):
+    key, session = _acquire(pool)
+    pool.release(key)
+    session.close()
+
+    pool._evict_idle()
+
+    assert key not in pool._sessions